@@ -1,9 +1,12 @@
 from datetime import date
+import gc
 import json 
 import matplotlib.pyplot as plt
+import multiprocessing as mp
 import numpy as np
 import os
 import pandas as pd 
+import random
 from scipy.stats import sem
 
 from simulation.params import Params
@@ -16,46 +19,67 @@ from world.population_generation import generate_city
 GROUP_COUNT = 16
 #How many times we generate the city and doing average upon
 REPS_NUM = 50
+#The lower age of each age group but the first one
+AGE_GROUP_EDGES = np.arange(5, 5 * GROUP_COUNT, 5)
+
+def _flatten_houses(city_arrays):
+    # all the ages of the city in one array, the people of house h are ages_flat[house_ptr[h]:house_ptr[h+1]]
+    house_ptr = np.zeros(len(city_arrays) + 1, dtype=np.int64)
+    house_ptr[1:] = np.cumsum([len(house) for house in city_arrays])
+    if len(city_arrays) == 0:
+        return np.zeros(0, dtype=np.int64), house_ptr
+    ages_flat = np.concatenate(city_arrays).astype(np.int64)
+    return ages_flat, house_ptr
 
 def count(city_arrays):
-    # convert each person to their age group,
-    for house_index in range(len(city_arrays)):
-        for prsn_index in range(len(city_arrays[house_index])):
-            city_arrays[house_index][prsn_index] = min(GROUP_COUNT - 1, city_arrays[house_index][prsn_index] // 5)
-    ret = np.zeros((GROUP_COUNT,GROUP_COUNT))  
-    for i in range(GROUP_COUNT):
-        #count the number of i's in the array
-        acc =0
-        for house in city_arrays:
-            if i in house:
-                for age in house:
-                    if age==i:
-                        acc += 1
-        for j in range(GROUP_COUNT):
-            cnt_j = 0 
-            for house in city_arrays: 
-                if j in house:
-                    if not(j==i):
-                        cnt_house_i = 0
-                        cnt_house_j = 0
-                        for age in house:
-                            if age == i:
-                                cnt_house_i += 1
-                            if age == j:
-                                cnt_house_j += 1
-                        cnt_j += cnt_house_i * cnt_house_j
-                    else:
-                        cnt_house_i = 0
-                        for age in house:
-                            if age == i:
-                                cnt_house_i += 1
-                        cnt_j += cnt_house_i * (cnt_house_i-1)
-            if (acc == 0):
-                ret[i][j] = 0
-            else: 
-                ret[i][j] = cnt_j / acc 
+    ages_flat, house_ptr = _flatten_houses(city_arrays)
+    houses_num = len(house_ptr) - 1
+    # age group of every person, the last group holds everyone from 75 and up
+    groups = np.digitize(ages_flat, AGE_GROUP_EDGES)
+    # count how many people of each age group live in each house
+    house_of_person = np.repeat(np.arange(houses_num), np.diff(house_ptr))
+    house_counts = np.bincount(house_of_person * GROUP_COUNT + groups, minlength=houses_num * GROUP_COUNT)
+    house_counts = house_counts.reshape((houses_num, GROUP_COUNT))
+    # acc[i] is the number of people in age group i
+    acc = house_counts.sum(axis=0)
+    # cnt[i][j] sums cnt_house_i * cnt_house_j over all houses,
+    # on the diagonal a person is not counted as his own contact: cnt_house_i * (cnt_house_i - 1)
+    cnt = house_counts.T @ house_counts - np.diag(acc)
+    ret = np.zeros((GROUP_COUNT, GROUP_COUNT))
+    np.divide(cnt, acc[:, None], out=ret, where=acc[:, None] != 0)
     return ret
 
+def _one_rep(rep_args):
+    #Generate a single city and count its household contacts, runs inside a pool worker
+    rep_index, city_name, tmp_city, paramsPath, PrintToLog = rep_args
+    random.seed(rep_index)
+    np.random.seed(rep_index)
+    Params.load_from(paramsPath, override=True)
+
+    cityArr = []
+    my_world = generate_city(city = tmp_city,
+                        is_smart_household_generation=True,
+                        internal_workplaces=True,
+                        scaling=1.0,
+                        verbosity=False,
+                        to_world=True)
+    my_world.sign_all_people_up_to_environments()
+    
+    #Generate array of array of household ages 
+    for house in my_world.get_all_city_households():
+        cityArr.append(np.fromiter((p.get_age() for p in house.get_people()), dtype=np.int8))
+    #People and environments reference each other, so the world is only freed by the cyclic gc,
+    #collect it here before the worker moves on to generate its next city
+    del my_world
+    gc.collect()
+
+    cityArrCounted = count(cityArr)
+    #print Logs to file
+    if (PrintToLog):
+        pd.DataFrame(cityArr).to_csv("{}{}.csv".format(city_name,rep_index))
+        pd.DataFrame(cityArrCounted).to_csv("{}{}_counted.csv".format(city_name,rep_index))
+    return cityArrCounted
+
 def generate_cities(city_name:str):
     #Generate city 
     INITIAL_DATE = date(year=2020, month=2, day=27)
@@ -67,61 +91,34 @@ def generate_cities(city_name:str):
         paramsDataPath = ConfigData['ParamsFilePath']
         PrintToLog = ((ConfigData['PrintToLog']).lower() in ['true'])
 
-    Params.load_from(os.path.join(os.path.dirname(__file__), paramsDataPath), override=True)
-       
-    cities = []
-    for i in range(REPS_NUM):
-        pop = population_loader.PopulationLoader(
-                citiesDataPath,
-                added_description="",
-                with_caching=False,
-                verbosity=False
-            )
-
-        cityArr = []
-        tmp_city = pop.get_city_by_name(city_name)
-        my_world = generate_city(city = tmp_city,
-                            is_smart_household_generation=True,
-                            internal_workplaces=True,
-                            scaling=1.0,
-                            verbosity=False,
-                            to_world=True)
-        my_world.sign_all_people_up_to_environments()
-        
-        #Generate array of array of household ages 
-        for house in my_world.get_all_city_households():
-            house_ages = []
-            for p in house.get_people():
-                house_ages.append(p.get_age())
-            cityArr.append(house_ages)
-
-        cityArrCounted = count(cityArr)
-        #print Logs to file
-        if (PrintToLog):
-            pd.DataFrame(cityArr).to_csv("{}{}.csv".format(city_name,i))
-            pd.DataFrame(cityArrCounted).to_csv("{}{}_counted.csv".format(city_name,i))
-        #Calc 50 matrixes from which we will calc the avg and error 
-        cities.append(cityArrCounted)
+    paramsPath = os.path.join(os.path.dirname(__file__), paramsDataPath)
+    Params.load_from(paramsPath, override=True)
+
+    #The city data is parsed once, only the generation of the city is done in every rep
+    pop = population_loader.PopulationLoader(
+            citiesDataPath,
+            added_description="",
+            with_caching=True,
+            verbosity=False
+        )
+    tmp_city = pop.get_city_by_name(city_name)
+
+    #The reps are independent of each other, so each one is generated on its own process
+    reps_args = [(i, city_name, tmp_city, paramsPath, PrintToLog) for i in range(REPS_NUM)]
+    #Calc 50 matrixes from which we will calc the avg and error 
+    cities = np.empty((REPS_NUM, GROUP_COUNT, GROUP_COUNT))
+    with mp.Pool(os.cpu_count()) as pool:
+        for i, cityArrCounted in enumerate(pool.imap_unordered(_one_rep, reps_args)):
+            cities[i] = cityArrCounted
     return cities
 
 def calc_avg(cities):
     #Calc avg matrix 
-    avg_mat = np.zeros((GROUP_COUNT,GROUP_COUNT))
-    for i in range(len(cities)):
-        avg_mat = avg_mat + cities[i]
-    avg_mat = avg_mat / REPS_NUM
-    return avg_mat
+    return np.asarray(cities).mean(axis=0)
 
 def calc_sem(cities):
     #Calc sem matrix    
-    sem_mat = np.zeros((GROUP_COUNT,GROUP_COUNT))
-    for i in range(GROUP_COUNT):
-        for j in range(GROUP_COUNT):
-            tmp =np.zeros(REPS_NUM)
-            for t in range(REPS_NUM):
-                tmp[t] =cities[t][i][j]
-            sem_mat[i][j] = sem(tmp)
-    return sem_mat
+    return sem(np.asarray(cities), axis=0)
 
 def save(avg_mat,sem_mat,city_name:str)->None:
     #Print results 
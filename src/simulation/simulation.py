@@ -1,9 +1,8 @@
 import logging
 import os
 import random as random
-from collections import Counter
 from datetime import timedelta
-from copy import deepcopy
+import numpy as np
 from seir.disease_state import DiseaseState
 
 from simulation.event import DayEvent
@@ -15,6 +14,20 @@ from world.environments import InitialGroup
 log = logging.getLogger(__name__)
 
 
+def _random_subset(population, k):
+    """
+    Choose k distinct people uniformly at random.
+    When k is a large part of the population, shuffling it once is cheaper than random.sample
+    :param population: list of Person, may be reordered in place
+    :param k: int number of people to choose
+    :return: list of Person
+    """
+    if k > len(population) // 2:
+        random.shuffle(population)
+        return population[:k]
+    return random.sample(population, k)
+
+
 class Simulation(object):
     """
     An object which runs a single simulation, holding a world,
@@ -33,8 +46,11 @@ class Simulation(object):
         'last_day_to_record_r',
         'num_r_days',
         'first_infectious_people',
+        '_first_infectious_ids',
+        '_first_infectious_remaining',
         'initial_infection_doc',
-        'num_days_to_run'
+        'num_days_to_run',
+        '_env_name_to_id'
     )
 
     def __init__(self, world, initial_date, interventions=None, stop_early=None, verbosity=False,
@@ -57,8 +73,9 @@ class Simulation(object):
         self._verbosity = verbosity
         self._world = world
         self._date = initial_date
-        self._initial_date = deepcopy(initial_date)
+        self._initial_date = initial_date
         self.interventions = interventions
+        # the registered DayEvents, keyed by the number of days from the initial date
         self._events = {}
         self.stats = Statistics(outdir, world)
         # It's important that we sign people up before we init interventions!
@@ -74,10 +91,15 @@ class Simulation(object):
             name_stop, self.num_r_days = self.stop_early
             self.last_day_to_record_r = initial_date + timedelta(days=self.num_r_days)
             assert name_stop == "r", "Other premature stops are not yet supported"
-        self.first_infectious_people = set()
+        self.first_infectious_people = []
+        # ids of the people in first_infectious_people, and those of them who may still be infected
+        self._first_infectious_ids = set()
+        self._first_infectious_remaining = []
 
         self.initial_infection_doc = None
         self.num_days_to_run = None
+        # ids of the infection environments names, used to count them in the verbose log
+        self._env_name_to_id = {}
 
         # save all the events that create the interventions behavior on the simulation
         for inter in self.interventions:
@@ -93,12 +115,15 @@ class Simulation(object):
         3. spread the infection throughout the environments
         4. register the changes to the Statistics object
         """
-        if self._date in self._events:
-            self._events[self._date].apply(self)
-            del self._events[self._date]
+        day = self._day_index(self._date)
+        if day in self._events:
+            self._events[day].apply(self)
+            del self._events[day]
 
+        # the population is fixed during the day, so it is fetched from the world only once
+        all_people = self._world.all_people()
         changed_population = [
-            person for person in self._world.all_people() if person._changed
+            person for person in all_people if person._changed
         ]
 
         for individual in changed_population:
@@ -108,15 +133,24 @@ class Simulation(object):
             self.register_events(env.propagate_infection(self._date))
 
         changed_population = [
-            person for person in self._world.all_people() if person._changed
+            person for person in all_people if person._changed
         ]
 
         if self._verbosity and self._date.weekday() == 6:
+            disease_states = np.fromiter(
+                (person._disease_state.value for person in all_people), dtype=np.int8, count=len(all_people)
+            )
+            state_counts = np.bincount(disease_states, minlength=len(DiseaseState) + 1)
+            infection_envs = np.fromiter(
+                (self._env_name_to_id.setdefault(person._infection_data.environment.name, len(self._env_name_to_id))
+                 for person in all_people if person.is_infected and person._infection_data),
+                dtype=np.int64
+            )
+            env_counts = np.bincount(infection_envs, minlength=len(self._env_name_to_id))
             log.info("------ day-{}: disease state ------------".format(self._date))
-            log.info(Counter([person.get_disease_state() for person in self._world.all_people()]))
+            log.info({state: int(state_counts[state.value]) for state in DiseaseState if state_counts[state.value]})
             log.info("------ Infected by environments ----------")
-            log.info(Counter([person.get_infection_data().environment.name for person in self._world.all_people() if
-                              person.get_disease_state().is_infected() and person.get_infection_data()]))
+            log.info({name: int(env_counts[env_id]) for name, env_id in self._env_name_to_id.items() if env_counts[env_id]})
 
         daily_data = DayStatistics(
             self._date,
@@ -128,8 +162,10 @@ class Simulation(object):
 
         if self.last_day_to_record_r is not None and self._date <= self.last_day_to_record_r:
             for person in changed_population:
-                if person.is_infected:
-                    self.first_infectious_people.add(person)
+                if person.is_infected and person._id not in self._first_infectious_ids:
+                    self._first_infectious_ids.add(person._id)
+                    self.first_infectious_people.append(person)
+                    self._first_infectious_remaining.append(person)
         self._date += timedelta(days=1)
 
     def register_event_on_day(self, event, date):
@@ -138,9 +174,18 @@ class Simulation(object):
         :param event: Event
         :param date: datetime Date
         """
-        if date not in self._events:
-            self._events[date] = DayEvent(date)
-        self._events[date].hook(event)
+        day = self._day_index(date)
+        if day not in self._events:
+            self._events[day] = DayEvent(date)
+        self._events[day].hook(event)
+
+    def _day_index(self, date):
+        """
+        The key of the given date in self._events
+        :param date: datetime Date
+        :return: int number of days from the initial date (negative for earlier dates)
+        """
+        return (date - self._initial_date).days
 
     def register_events(self, event_list):
         """
@@ -182,25 +227,25 @@ class Simulation(object):
         assert len(population) >= num_infected + num_immuned \
             , "Trying to immune:{} infect:{} people out of {}".format(num_immuned, num_infected, len(population))
         
-        used_persons = {}
         #First set the immune persons that are above min_age
-        while num_immuned > 0: #we start to count from zero therefor we need one more person
-            Selected_persons = random.sample(population, num_immuned)
-            for p in Selected_persons:
-                if (p.get_age() >= min_age) and (p.get_id() not in used_persons) : 
-                    self.register_events(p.immune_and_get_events(self._date, InitialGroup.initial_group()))
-                    num_immuned = num_immuned-1
-                    used_persons[p.get_id()] = p
-        for p in used_persons.values():
+        eligible_immune = [p for p in population if p.get_age() >= min_age]
+        assert len(eligible_immune) >= num_immuned \
+            , "Trying to immune:{} people out of {} above age {}".format(num_immuned, len(eligible_immune), min_age)
+        immune_set = _random_subset(eligible_immune, num_immuned)
+        for p in immune_set:
+            self.register_events(p.immune_and_get_events(self._date, InitialGroup.initial_group()))
+        used_ids = {p.get_id() for p in immune_set}
+        for p in immune_set:
             print("id:" + str(p.get_id()) +" age:"+ str(p.get_age())) 
 
         #Second set the people that aren't immune to be infected
-        while num_infected > 0:
-            Selected_persons = random.sample(population, num_infected)
-            for p in Selected_persons:
-                if (p.get_id() not in used_persons) and (p.get_disease_state() == DiseaseState.SUSCEPTIBLE): 
-                    self.register_events(p.infect_and_get_events(self._date, InitialGroup.initial_group()))
-                    num_infected = num_infected-1
+        eligible_infect = [p for p in population \
+            if (p.get_id() not in used_ids) and (p.get_disease_state() == DiseaseState.SUSCEPTIBLE)]
+        assert len(eligible_infect) >= num_infected \
+            , "Trying to infect:{} people out of {} susceptible".format(num_infected, len(eligible_infect))
+        infect_set = _random_subset(eligible_infect, num_infected)
+        for p in infect_set:
+            self.register_events(p.infect_and_get_events(self._date, InitialGroup.initial_group()))
 
     def immune_households_infect_others(self,num_infected : int, infection_doc : str, per_to_immune=0.0, city_name=None,min_age = 0):
         """
@@ -220,7 +265,7 @@ class Simulation(object):
         if per_to_immune is None:
             per_to_immune = 0.0
         if city_name is not None:
-            households = [h for h in self._world.get_all_city_households() if h._city == city_name]
+            households = list(self._world.households_by_city.get(city_name.lower(), []))
         else:
             households = [h for h in self._world.get_all_city_households()]
         #Select houses immun 
@@ -237,7 +282,7 @@ class Simulation(object):
         if num_infected > 0:
             UnsafePersons = [person for house in not_safe_group for person in house.get_people() \
              if person.get_disease_state() == DiseaseState.SUSCEPTIBLE]
-            people_to_infect = random.sample(UnsafePersons, min(len(UnsafePersons),num_infected))
+            people_to_infect = _random_subset(UnsafePersons, min(len(UnsafePersons),num_infected))
             for person in people_to_infect:
                 self.register_events(person.infect_and_get_events(self._date, InitialGroup.initial_group()))
     
@@ -249,7 +294,11 @@ class Simulation(object):
         """
         if self.stop_early is None:
             return False
-        return all((not person.is_infected) for person in self.first_infectious_people)
+        # people who are no longer infected are dropped, so every day we only go over those still infected
+        self._first_infectious_remaining = [
+            person for person in self._first_infectious_remaining if person.is_infected
+        ]
+        return len(self._first_infectious_remaining) == 0
 
     def infect_chosen_set(self, infection_datas, infection_doc):
         """
@@ -266,11 +315,12 @@ class Simulation(object):
             self.register_events(events)
 
         original_date = self._date
-        for date in sorted(self._events.keys()):
-            if date < original_date:
-                self._date = date
-                self._events[date].apply(self)
-                del self._events[date]
+        original_day = self._day_index(original_date)
+        for day in sorted(self._events.keys()):
+            if day < original_day:
+                self._date = self._events[day]._date
+                self._events[day].apply(self)
+                del self._events[day]
         self._date = original_date
 
     def run_simulation(self, num_days, name, datas_to_plot=None,run_simulation = None,extensionsList = None):
@@ -299,14 +349,18 @@ class Simulation(object):
                 extensions = extensions + [ExtensionType(self)]
             
 
+        #Bind the extensions' daily hooks once, instead of looking them up every day
+        start_of_day_hooks = [ext.start_of_day_processing for ext in extensions]
+        end_of_day_hooks = [ext.end_of_day_processing for ext in extensions]
+
         for day in range(num_days):
-            for ext in extensions:
-                ext.start_of_day_processing()
+            for start_of_day in start_of_day_hooks:
+                start_of_day()
 
             self.simulate_day()
             #Call Extension function at the end of the day
-            for ext in extensions:
-                ext.end_of_day_processing()
+            for end_of_day in end_of_day_hooks:
+                end_of_day()
                 
             if self.stats.is_static() or self.first_people_are_done():
                 if self._verbosity:
@@ -2,6 +2,7 @@ from world.environments.environment import Environment
 
 
 class InitialGroup(Environment):
+    __slots__ = ()
     name = "initial_group"
     singleton = None
 
@@ -3,7 +3,8 @@ class World(object):
     """
     The World class holds all the people and their environments for the simulation.
     """
-    __slots__ = ('_people_dict', 'all_environments', '_city_name_to_env', '_generating_city_name', '_generating_scale')
+    __slots__ = ('_people_dict', 'all_environments', '_city_name_to_env', '_generating_city_name', '_generating_scale',
+                 'households_by_city')
 
     def __init__(self, all_people, all_environments, generating_city_name, generating_scale):
         """
@@ -49,6 +50,16 @@ class World(object):
         """
         for person in self.all_people():
             person.register_to_daily_environments()
+        self._init_city_name_to_households_dict()
+
+    def _init_city_name_to_households_dict(self):
+        """
+        Save all the households by the (lowered) name of their city
+        """
+        self.households_by_city = {}
+        for household in self.get_all_city_households():
+            name = household._city.english_name.lower()
+            self.households_by_city.setdefault(name, []).append(household)
 
     def get_all_city_communities(self):
         """
@@ -1,3 +1,4 @@
+import numpy as np
 from main import GROUP_COUNT, Plot3d,REPS_NUM, count,save,calc_avg,calc_sem
 from math import isnan
 
@@ -232,4 +233,20 @@ def test_count10():
     Plot3d(expected = res,city_name="res.png")
     Plot3d(expected = avg_mat,city_name="avg.png")
     helper(res = res,expected = expected)
-    
\ No newline at end of file
+    
+
+def test_count_pairs():
+    # count every ordered pair of people in each house directly, and compare to count
+    rng = np.random.default_rng(0)
+    city_arrays = [rng.integers(0, 100, size=rng.integers(1, 9)) for _ in range(200)]
+    contacts = np.zeros((GROUP_COUNT,GROUP_COUNT))
+    acc = np.zeros(GROUP_COUNT)
+    for house in city_arrays:
+        groups = np.minimum(house // 5, GROUP_COUNT - 1)
+        np.add.at(contacts, (groups[:, None], groups[None, :]), 1)
+        np.add.at(acc, groups, 1)
+    contacts -= np.diag(acc)
+    expected = np.zeros((GROUP_COUNT,GROUP_COUNT))
+    np.divide(contacts, acc[:, None], out=expected, where=acc[:, None] != 0)
+    res = count(city_arrays)
+    assert np.allclose(res, expected)